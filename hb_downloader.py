@@ -1,65 +1,218 @@
 #!/bin/python3
 import argparse
+import asyncio
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import lru_cache
 from json import JSONDecodeError
-from math import floor, log2
 from pathlib import Path
-from sys import exit, stdout
-from typing import Any, Dict, List, Optional, Tuple
+from posixpath import basename
+from sys import exit, maxsize, stdout, version_info
+from time import monotonic
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 from ruamel.yaml import YAML  # type: ignore
 from slugify import slugify
+from urllib3.util import Retry
+
+try:
+    from yaml import CSafeLoader  # type: ignore
+    from yaml import load as libyaml_load
+except ImportError:
+    CSafeLoader = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import h2  # type: ignore  # noqa: F401, needed by httpx for HTTP/2
+    import httpx
+except ImportError:
+    httpx = None
 
 logger.remove(0)
 logger.add(
     stdout,
     level='WARNING',
     colorize=True,
+    enqueue=True,  # workers only queue messages, one thread writes them
     format="\x1b[A\r<level>{level}:</level> {message}\x1b[K\x1b[B\x1b[B"
 )
 
+CHUNK_SIZE = 1 << 22  # 4 MiB, used for both network and disk reads
+PARALLEL_MIN_SIZE = 1 << 26  # split only files bigger than 64 MiB
+
+# many products share bundle name, so slugify each string only once
+cached_slugify = lru_cache(maxsize=4096)(slugify)
+
+_last_render = 0.0
+
 
 def human_size(x: int) -> str:
     if x == 0:
         return '0 B'
     suffixes = ['B', 'kiB', 'MiB', 'GiB', 'TiB']
-    exponent = floor(log2(x) / 10) * 10
-    x = x / 2 ** exponent
-    suffix = suffixes[exponent // 10]
-    return f'{x:.2f} {suffix}'
+    exponent = (x.bit_length() - 1) // 10
+    return f'{x / (1 << exponent * 10):.2f} {suffixes[exponent]}'
+
+
+def md5sum(filepath: Path, blocksize: int = CHUNK_SIZE) -> str:
+    with open(filepath, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if version_info >= (3, 11):
+            # read/update loop runs in C and releases GIL
+            return hashlib.file_digest(f, 'md5').hexdigest()
+        filehash = hashlib.md5()
+        # reuse one buffer instead of allocating new bytes for every block
+        buffer = bytearray(blocksize)
+        view = memoryview(buffer)
+        while size := f.readinto(buffer):
+            filehash.update(view[:size])
+    return filehash.hexdigest()
 
 
-def md5sum(filepath: Path, blocksize: int = 65536) -> str:
-    filehash = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        for block in iter(lambda: f.read(blocksize), b''):
-            filehash.update(block)
-    return filehash.hexdigest()
+def md5sum_mmap(filepath: Path) -> str:
+    size = filepath.stat().st_size
+    # mapping small files costs more than reading them, empty ones can't be
+    # mapped at all and big ones don't fit 32-bit address space
+    if size < 1 << 20 or (maxsize < 2**32 and size >= 2**31):
+        return md5sum(filepath)
+    with open(filepath, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        return hashlib.md5(mm).hexdigest()
+
+
+def preallocate(f: BinaryIO, size: int) -> None:
+    # reserve space upfront, so big files don't end up fragmented
+    if size <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            logger.debug(f'Preallocation not supported for {f.name}')
+    else:
+        f.truncate(size)
+        f.seek(0)
 
 
 def download(
+    session: requests.Session,
     urllink: str,
     filepath: Path,
     reported_size: int,
-    chunk_size: int = 1048576
-) -> bool:
-    with requests.get(urllink, stream=True) as r:
+    chunk_size: int = CHUNK_SIZE
+) -> str:
+    filehash = hashlib.md5()
+    with session.get(urllink, stream=True) as r:
         total_length = int(r.headers.get('content-length'))  # type: ignore
         if total_length != reported_size:
             raise ValueError
         with open(filepath, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=chunk_size):
+            preallocate(f, reported_size)
+            # read raw stream directly, skipping iter_content generator layers
+            for chunk in iter(
+                lambda: r.raw.read(chunk_size, decode_content=True), b''
+            ):
                 f.write(chunk)
-    return True
+                filehash.update(chunk)
+    return filehash.hexdigest()
+
+
+def range_length(session: requests.Session, urllink: str) -> Optional[int]:
+    # one byte probe, returns full size only if server honours ranges
+    headers = {'Range': 'bytes=0-0'}
+    with session.get(urllink, stream=True, headers=headers) as r:
+        if r.status_code != 206:
+            return None
+        return int(r.headers['content-range'].rpartition('/')[2])
+
+
+def download_range(
+    session: requests.Session,
+    urllink: str,
+    fd: int,
+    start: int,
+    end: int,
+    chunk_size: int = CHUNK_SIZE
+) -> None:
+    headers = {'Range': f'bytes={start}-{end}'}
+    with session.get(urllink, stream=True, headers=headers) as r:
+        if r.status_code != 206:
+            raise ValueError
+        offset = start
+        for chunk in iter(
+            lambda: r.raw.read(chunk_size, decode_content=True), b''
+        ):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise ValueError
+
+
+def download_parallel(
+    session: requests.Session,
+    urllink: str,
+    filepath: Path,
+    reported_size: int,
+    parts: int,
+    chunk_size: int = CHUNK_SIZE
+) -> str:
+    if not hasattr(os, 'pwrite'):
+        return download(session, urllink, filepath, reported_size, chunk_size)
+    total_length = range_length(session, urllink)
+    if total_length is None:
+        return download(session, urllink, filepath, reported_size, chunk_size)
+    if total_length != reported_size:
+        raise ValueError
+    step = -(-reported_size // parts)
+    with open(filepath, 'wb') as f:
+        preallocate(f, reported_size)
+        with ThreadPoolExecutor(max_workers=parts) as executor:
+            futures = [
+                executor.submit(
+                    download_range,
+                    session,
+                    urllink,
+                    f.fileno(),
+                    start,
+                    min(start + step, reported_size) - 1,
+                    chunk_size
+                ) for start in range(0, reported_size, step)
+            ]
+            for future in futures:
+                future.result()
+    # parts arrive out of order, so file can be hashed only at the end
+    return md5sum_mmap(filepath)
 
 
 def progress_bar(
-    count: int, total: int, bar_length: int = 60, suffix: str = ''
+    count: int,
+    total: int,
+    bar_length: int = 60,
+    suffix: str = '',
+    force: bool = False
 ) -> None:
+    global _last_render
+    now = monotonic()
+    # redraw at most every 50 ms, but always draw finished bar
+    if now - _last_render < 0.05 and count < total and not force:
+        return
+    _last_render = now
     filled_length = bar_length * count // total
     stdout.write(
         f'[{"="*filled_length:-<{bar_length}}] {count / total:.1%} … {suffix}\x1b[K\r'
@@ -67,10 +220,14 @@ def progress_bar(
     stdout.flush()
 
 
+@lru_cache(maxsize=4096)
+def bundle_folder(date: datetime, bundle_name: str) -> str:
+    # same for all products of an order, so format it once per order
+    return f"{date.strftime('%Y-%m-%d')} {cached_slugify(bundle_name)}"
+
+
 def extract_filename(product):
-    filename = product.url[: product.url.find('?')]
-    filename = filename[filename.rfind('/') + 1 :]
-    return filename
+    return basename(urlsplit(product.url).path)
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -110,6 +267,13 @@ def create_parser() -> argparse.ArgumentParser:
         action='store_true',
         help='Download smallest files first'
     )
+    parser.add_argument(
+        '-a',
+        '--async',
+        dest='async_orders',
+        action='store_true',
+        help='Get purchase info asynchronously over HTTP/2, requires httpx'
+    )
     return parser
 
 
@@ -117,9 +281,8 @@ def parse_config(
     parser: argparse.ArgumentParser
 ) -> Tuple[List[str], dict[str, Any]]:
     try:
-        with open('config.yaml') as yamlfile:
-            cfg = yaml.load(yamlfile)
-            _ = cfg.keys()  # check if file is not empty
+        cfg = load_data(Path('config.yaml'))
+        _ = cfg.keys()  # check if file is not empty
     except (FileNotFoundError, AttributeError):
         Path('config.yaml').write_text(Path('example_config.yaml').read_text())
         logger.warning("No valid config file, creating default.")
@@ -128,24 +291,58 @@ def parse_config(
         del cfg['trove']
     except KeyError:
         logger.debug("Already at new config")
-    platforms = parser.parse_args().platform
-    download_limit = parser.parse_args().download_limit[0]
+    args = parser.parse_args()
+    platforms = args.platform
+    download_limit = args.download_limit[0]
     if download_limit:
         cfg['download_limit'] = download_limit
-    purchase_limit = parser.parse_args().purchase_limit[0]
+    purchase_limit = args.purchase_limit[0]
     if purchase_limit:
         cfg['purchase_limit'] = purchase_limit
-    if parser.parse_args().smallest_first:
+    if args.smallest_first:
         cfg['smallest_first'] = True
+    if args.async_orders:
+        cfg['async_orders'] = True
     return platforms, cfg
 
 
-def dump_data(to_dump: Any, filepath: Path) -> None:
-    to_dump = [item.__dict__ for item in to_dump]
+def json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_data(filepath: Path, json_copy: bool = False) -> Any:
+    # prefer json copy from dump_data, unless yaml was edited after it
+    json_path = filepath.with_suffix('.json')
+    try:
+        if json_copy and (
+            json_path.stat().st_mtime_ns >= filepath.stat().st_mtime_ns
+        ):
+            data = json_loads(json_path.read_bytes())
+            for item in data:
+                item['date'] = datetime.fromisoformat(item['date'])
+            return data
+    except (FileNotFoundError, ValueError, TypeError, KeyError):
+        logger.debug(f'No valid json copy of {filepath.name}')
+    text = filepath.read_text()
+    # files written by dump_data are YAML 1.1, which libyaml parses the same
+    if CSafeLoader is not None and text.startswith('%YAML 1.1'):
+        return libyaml_load(text, Loader=CSafeLoader)
+    return yaml.load(text)
+
+
+def dump_data(to_dump: Any, filepath: Path, json_copy: bool = False) -> None:
+    to_dump = [{k: getattr(item, k) for k in item.fields} for item in to_dump]
     to_dump = sorted(to_dump, key=lambda i: (i['date'], i['name']))
     yaml.indent(mapping=4, sequence=6, offset=3)
+    yaml.version = (1, 1)  # quote scalars like 'yes' for libyaml reader
     with open(filepath, 'w') as file:
         yaml.dump(to_dump, file)
+    if json_copy:  # written after yaml, so it's never older
+        filepath.with_suffix('.json').write_text(
+            json.dumps(to_dump, default=datetime.isoformat)
+        )
 
 
 class HumbleApi:
@@ -162,15 +359,22 @@ class HumbleApi:
     def __init__(
         self,
         download_limit: int = 6,
+        metadata_limit: int = 8,
         purchase_limit: int = 0,
         smallest_first: bool = False,
+        async_orders: bool = False,
+        download_parts: int = 1,
         download_folder: str = '.',
         platforms: list[str] = [],
         session_cookie: str = ''
     ):
         self.download_limit = download_limit
+        # API requests are sized separately from file downloads
+        self.metadata_limit = metadata_limit
         self.purchase_limit = purchase_limit
         self.reverse_order = not smallest_first
+        self.async_orders = async_orders
+        self.download_parts = download_parts
 
         self.download_folder = Path(download_folder).expanduser()
         self.download_folder.mkdir(exist_ok=True)
@@ -181,18 +385,43 @@ class HumbleApi:
         self.session.cookies.update({'_simpleauth_sess': session_cookie})
         self.session.headers.update(self.default_headers)
         self.session.params.update({'ajax': 'true'})  # type: ignore
+        self.session.mount(
+            'https://',
+            HTTPAdapter(
+                pool_connections=2,
+                pool_maxsize=max(self.metadata_limit, 10),
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=[429, 502, 503, 504],
+                    raise_on_status=False  # let caller report bad response
+                )
+            )
+        )
+
+        # separate session, so CDN requests don't get API cookie and params
+        self.download_session = requests.Session()
+        self.download_session.mount(
+            'https://',
+            HTTPAdapter(
+                pool_connections=self.download_limit,
+                pool_maxsize=self.download_limit * max(download_parts, 2),
+                max_retries=Retry(total=3, backoff_factor=0.3)
+            )
+        )
 
         try:
-            with open('downloaded.yaml') as yamlfile:
-                tmp = yaml.load(yamlfile)
-                self.downloaded_list = [Product(**item) for item in tmp]
-                self.checked_list = [
-                    item for item in self.downloaded_list if item.checked
-                ]
+            tmp = load_data(Path('downloaded.yaml'), json_copy=True)
+            self.downloaded_list = [Product(**item) for item in tmp]
+            self.downloaded_set = set(self.downloaded_list)
+            self.checked_set = {
+                item for item in self.downloaded_list if item.checked
+            }
         except FileNotFoundError:
             logger.debug('First time running')
             self.downloaded_list = []
-            self.checked_list = []
+            self.downloaded_set = set()
+            self.checked_set = set()
 
         self.orders_num = 0
         self.total_size = 0
@@ -222,34 +451,82 @@ class HumbleApi:
     def get_order_list(self):
         r = self.session.get(self.ORDER_LIST_URL)
         try:
-            r = r.json()
+            r = json_loads(r.content)
             self.order_key_list = [item['gamekey'] for item in r]
             self.orders_num = len(self.order_key_list)
         except JSONDecodeError:
             logger.warning("Can't extract data from HB")
             exit()
 
-    def get_order_info(self, i, order):
-        r = self.session.get(self.ORDER_URL.format(order_id=order))
+    def parse_order(self, order, r):
         try:
-            r = r.json()
+            r = json_loads(r.content)
         except JSONDecodeError:
             logger.error(
                 f'Problem with getting info about {self.ORDER_URL.format(order_id=order)}'
             )
-            return info, []
-        return i, Order(r['subproducts'], r['product']['human_name'], r['created'])
+            return None
+        return Order(r['subproducts'], r['product']['human_name'], r['created'])
 
-    def get_product_list(self):
-        with ThreadPoolExecutor(max_workers=self.download_limit) as executor:
-            for info, order in executor.map(
-                self.get_order_info, range(self.orders_num), self.order_key_list
-            ):
+    def get_order_info(self, order):
+        r = self.session.get(self.ORDER_URL.format(order_id=order))
+        return self.parse_order(order, r)
+
+    async def get_order_info_async(self, client, semaphore, order):
+        try:
+            async with semaphore:
+                r = await client.get(self.ORDER_URL.format(order_id=order))
+        except httpx.HTTPError:
+            logger.error(
+                f'Problem with getting info about {self.ORDER_URL.format(order_id=order)}'
+            )
+            return None
+        return self.parse_order(order, r)
+
+    async def get_orders_async(self):
+        # all requests are multiplexed over single HTTP/2 connection
+        semaphore = asyncio.Semaphore(self.metadata_limit)
+        async with httpx.AsyncClient(
+            headers=self.default_headers,
+            cookies=self.session.cookies.get_dict(),
+            params={'ajax': 'true'},
+            timeout=None,  # same as requests session on threaded path
+            # retry failed connects, like Retry in requests session
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=3)
+        ) as client:
+            tasks = [
+                self.get_order_info_async(client, semaphore, order)
+                for order in self.order_key_list
+            ]
+            for info, task in enumerate(asyncio.as_completed(tasks)):
+                order = await task
                 if order:
                     self.order_list.append(order)
                 progress_bar(
                     info + 1, self.orders_num, suffix='Getting Products'
                 )
+
+    def get_product_list(self):
+        if self.async_orders and httpx is None:
+            logger.warning("httpx[http2] not installed, using threads")
+        if self.async_orders and httpx is not None:
+            asyncio.run(self.get_orders_async())
+        else:
+            with ThreadPoolExecutor(
+                max_workers=self.metadata_limit
+            ) as executor:
+                futures = [
+                    executor.submit(self.get_order_info, order)
+                    for order in self.order_key_list
+                ]
+                # slow orders don't hold back ones that are already parsed
+                for info, future in enumerate(as_completed(futures)):
+                    order = future.result()
+                    if order:
+                        self.order_list.append(order)
+                    progress_bar(
+                        info + 1, self.orders_num, suffix='Getting Products'
+                    )
         print('\n')
         self.order_list.sort(
             key=lambda x: x.date, reverse=False
@@ -261,32 +538,26 @@ class HumbleApi:
         }
 
     def get_download_list(self):
-        self.to_download_set = {
-            item
-            for order in self.order_list[-self.purchase_limit :]
-            for item in order.products
-        }
+        # split orders once: products from older purchases are not downloaded
+        limit = self.purchase_limit or 0
+        cutoff = max(len(self.order_list) - limit, 0) if limit else 0
         self.to_not_download_set = {
             item
-            for order in self.order_list[:-self.purchase_limit]
+            for order in self.order_list[:cutoff]
             for item in order.products
         }
-
-        self.to_download_set = self.to_download_set.difference(
-            self.to_not_download_set
-        )
-
         self.check_platforms()
+        platforms = set(self.platforms)
 
+        # single pass over recent products, skipping already checked ones
         self.to_download_set = {
             item
-            for item in self.to_download_set
-            if item.platform in self.platforms
+            for order in self.order_list[cutoff:]
+            for item in order.products
+            if item.platform in platforms
+            and item not in self.to_not_download_set
+            and item not in self.checked_set
         }
-        self.to_download_set = self.to_download_set.difference(
-            self.checked_list
-        )
-        # above line to have only new items and items, which are not checked already
         self.to_download_list = list(self.to_download_set)
         self.total_size = sum(item.size for item in self.to_download_list)
         self.human_size = human_size(self.total_size)
@@ -295,15 +566,23 @@ class HumbleApi:
         self.to_download_list.sort(
             key=lambda x: x.size, reverse=self.reverse_order
         )
-        self.orphaned_set = set(self.downloaded_list).difference(self.all_set)
+        self.orphaned_set = self.downloaded_set.difference(self.all_set)
         #self.orphaned_set = self.all_set.difference(self.downloaded_list)
 
     def download_helper(self):
         self.clean_orphan()
+        # create every target folder once, instead of from each worker
+        directories = {self.item_directory(x) for x in self.to_download_list}
+        for directory in directories:
+            directory.mkdir(parents=True, exist_ok=True)
         with ThreadPoolExecutor(max_workers=self.download_limit) as executor:
-            for product in executor.map(
-                self.download, range(self.total_items), self.to_download_list
-            ):
+            futures = [
+                executor.submit(self.download, item)
+                for item in self.to_download_list
+            ]
+            # handle files as they finish, not in submission order
+            for future in as_completed(futures):
+                product = future.result()
                 if product is not None:
                     self.downloading_list.append(product)
                 progress_bar(
@@ -312,21 +591,38 @@ class HumbleApi:
                     suffix=
                     f'Downloading: {human_size(self.downloaded_size)}/{self.human_size}'
                 )
+        # last update could be skipped, when some download failed
+        if self.total_size:
+            progress_bar(
+                self.downloaded_size,
+                self.total_size,
+                suffix=
+                f'Downloading: {human_size(self.downloaded_size)}/{self.human_size}',
+                force=True
+            )
         print('\n')
         self.save_data()
 
-    def clean_orphan(self):
-        root = self.download_folder
+    def item_directory(self, item):
+        return self.download_folder.joinpath(
+            item.platform, item.bundle_folder, item.slug_name
+        )
 
-        for item in self.orphaned_set:
-            bundle_name = f'{item.date.date()} {slugify(item.bundle_name)}'
-            item_name = slugify(item.name)
-            filename = Path(
-                f'{root}/{item.platform}/{bundle_name}/{item_name}/{extract_filename(item)}'
-            )
+    def orphan_md5(self, item):
+        filename = self.item_directory(item) / item.filename
+        if filename.exists():
+            return item, filename, md5sum_mmap(filename)
+        return item, filename, None
 
-            if filename.exists():
-                if item.md5 == md5sum(filename):
+    def clean_orphan(self):
+        # hash in parallel, but move files only from main thread
+        with ThreadPoolExecutor(max_workers=self.download_limit) as executor:
+            for item, filename, md5 in executor.map(
+                self.orphan_md5, self.orphaned_set
+            ):
+                if md5 is None:
+                    logger.debug(f"File already moved {filename.name}")
+                elif item.md5 == md5:
                     logger.warning(f"Moving orphaned file {filename.name}")
                     item2 = filename.parents[3].joinpath(
                         'orphaned', *filename.parts[-4 :]
@@ -340,16 +636,20 @@ class HumbleApi:
                         i += 1
                     item2.parent.mkdir(parents=True, exist_ok=True)
                     filename.rename(item2)
-            else:
-                logger.debug(f"File already moved {filename.name}")
 
     def check_file(self, product, filename):
         if not filename.exists():
             logger.info(
                 f'File missing: {filename.name} {human_size(product.size)}'
             )
+        elif filename.stat().st_size != product.size:
+            # can't match md5 anyway, no need to read whole file
+            logger.error(
+                f'File mismatch size, deleting {product.name}, {filename}'
+            )
+            filename.unlink()
         else:
-            md5 = md5sum(filename)
+            md5 = md5sum_mmap(filename)
             if md5 == product.md5:
                 logger.success(f'File checked {filename.name}')
                 return True
@@ -361,30 +661,33 @@ class HumbleApi:
                 filename.unlink()
         return False
 
-    def download(self, i, item):
-        name = slugify(item.bundle_name)
-        name = item.date.strftime('%Y-%m-%d ') + name
-        directory = self.download_folder / Path(
-            item.platform
-        ) / Path(name) / Path(slugify(item.name))
-
-        directory.mkdir(parents=True, exist_ok=True)
-
-        filename = directory / Path(extract_filename(item))
+    def download(self, item):
+        filename = self.item_directory(item) / item.filename
 
         if self.check_file(item, filename):
             self.downloaded_size += item.size
             item.checked = True
             return item
         else:
+            # write under temporary name, so interrupted download never
+            # leaves file with full size under final name
+            part = filename.with_name(filename.name + '.part')
             try:
                 logger.debug(
                     f"Download start for '{item.name}' {filename.name}"
                 )
-                info = download(item.url, filename, item.size)
-                if info:
-                    logger.success(
-                        f"Downloaded {filename.name} {human_size(item.size)}"
+                split = item.size >= PARALLEL_MIN_SIZE
+                if self.download_parts > 1 and split:
+                    md5 = download_parallel(
+                        self.download_session,
+                        item.url,
+                        part,
+                        item.size,
+                        self.download_parts
+                    )
+                else:
+                    md5 = download(
+                        self.download_session, item.url, part, item.size
                     )
             except ValueError:
                 logger.warning(f"Mismatch in reported size {filename.name}")
@@ -393,38 +696,42 @@ class HumbleApi:
             except ConnectionResetError:
                 logger.warning(f"Connection problem when getting {filename}")
             else:
-                if filename.exists():
-                    if item.size != filename.stat().st_size:
-                        logger.error(
-                            f"Deleting file with incorrect size {filename}"
-                        )
-                        filename.unlink()
-                        return
-                    else:
-                        self.downloaded_size += item.size
-                        item.checked = False
-                    return item
+                # content-length was checked, digest covers the content
+                if md5 != item.md5:
+                    logger.error(
+                        f"Deleting file with incorrect md5sum {filename}"
+                    )
+                    return
+                part.replace(filename)
+                logger.success(
+                    f"Downloaded {filename.name} {human_size(item.size)}"
+                )
+                self.downloaded_size += item.size
+                item.checked = True
+                return item
+            finally:
+                part.unlink(missing_ok=True)
 
     def save_data(self):
-        to_dump = set(self.downloading_list).union(self.downloaded_list)
-        dump_data(to_dump, 'downloaded.yaml')
-        dump_data(self.orphaned_set, 'orphaned.yaml')
+        # fresh entries first, so their checked state is kept in union
+        to_dump = set(self.downloading_list).union(self.downloaded_set)
+        dump_data(to_dump, Path('downloaded.yaml'), json_copy=True)
+        dump_data(self.orphaned_set, Path('orphaned.yaml'))
         to_dump = self.all_set.difference(to_dump)
-        dump_data(to_dump, 'not-downloaded.yaml')
+        dump_data(to_dump, Path('not-downloaded.yaml'))
 
 
 class Order:
 
-    def __init__(self, json_list: list[dict[str, Any]], name: str, date: str):
-        self.products: list[Product] = []
-        self.bundle_name = name
-        self.date = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%f')
-        self.name_exclusion = [
+    name_exclusion = frozenset(
+        {
             'thespookening_android',
             'worldofgoo_android_pc_soundtrack_audio',
             'dustforce_asm'
-        ]
-        self.md5_exclusion = [
+        }
+    )
+    md5_exclusion = frozenset(
+        {
             'c0776421f3527a706cf1f3f3765cafb4',  # issue 1
             '2f8612361dde58c73525ea0d024c0460',  # issue 1
             'bcb063559d17364e9f7bfd3d4fd799ee',  # issue 1
@@ -432,19 +739,23 @@ class Order:
             '748b36888d3c6e747dc00eea5d518bb9',
             'ef8a5895edce744719bc031ffb0173b0',
             'b5796f487f5f647045bb5fb6eaf16edf'  # issue 2 -- SOMA mac version
-        ]
+        }
+    )
+
+    def __init__(self, json_list: list[dict[str, Any]], name: str, date: str):
+        self.products: list[Product] = []
+        self.bundle_name = name
+        self.date = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%f')
         for product in json_list:
-            try:
-                name = product['human_name']
-            except KeyError:
-                pass
-            else:
-                for items in product['downloads']:
-                    machine_name = items['machine_name']
-                    for struct in items['download_struct']:
-                        self.extract_data(
-                            struct, items['platform'], name, machine_name
-                        )
+            name = product.get('human_name')
+            if name is None:
+                continue
+            for items in product['downloads']:
+                machine_name = items['machine_name']
+                for struct in items['download_struct']:
+                    self.extract_data(
+                        struct, items['platform'], name, machine_name
+                    )
 
     def extract_data(
         self,
@@ -453,53 +764,92 @@ class Order:
         name: str,
         machine_name: str
     ) -> None:
-        try:
-            url = struct['url']['web']
-            size = struct['file_size']
-            md5 = struct['md5']
-            machine_name = machine_name
-        except KeyError:
+        url = struct.get('url', {}).get('web')
+        size = struct.get('file_size')
+        md5 = struct.get('md5')
+        if url is None or size is None or md5 is None:
             if machine_name not in self.name_exclusion:
                 logger.error(f'Problem with parsing {machine_name}')
-                pass
-        else:
-            if md5 not in self.md5_exclusion:
-                data = {
-                    'name': name,
-                    'url': url,
-                    'size': size,
-                    'md5': md5,
-                    'platform': platform,
-                    'bundle_name': self.bundle_name,
-                    'date': self.date,
-                    'machine_name': machine_name
-                }
-                self.products.append(Product(**data))
+        elif md5 not in self.md5_exclusion:
+            self.products.append(
+                Product(
+                    name,
+                    url,
+                    size,
+                    md5,
+                    platform,
+                    self.date,
+                    self.bundle_name,
+                    machine_name
+                )
+            )
 
 
 class Product:
 
-    def __init__(self, **kwargs: Any):
-        self.checked: bool = False
-        self.md5: str
-        self.size: int
-        self.name: str
-        for key in kwargs.keys():
-            setattr(self, key, kwargs[key])
-        if hasattr(self, 'hb_name'):  # this convert from old downloaded.yaml
+    fields = (
+        'name',
+        'url',
+        'size',
+        'md5',
+        'platform',
+        'bundle_name',
+        'date',
+        'machine_name',
+        'checked'
+    )
+    __slots__ = fields + ('_key', '_hash')
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        size: int,
+        md5: str,
+        platform: str,
+        date: datetime,
+        bundle_name: str = '',
+        machine_name: str = '',
+        checked: bool = False,
+        **legacy: Any
+    ):
+        if 'hb_name' in legacy:  # this convert from old downloaded.yaml
             logger.debug(
-                f'Converting old hb_name to new bundle_name for {self.name}'
+                f'Converting old hb_name to new bundle_name for {name}'
             )
-            setattr(self, 'bundle_name', self.hb_name)
-            delattr(self, 'hb_name')
+            bundle_name = legacy['hb_name']
+        self.name = name
+        self.url = url
+        self.size = size
+        self.md5 = md5
+        self.platform = platform
+        self.bundle_name = bundle_name
+        self.date = date
+        self.machine_name = machine_name
+        self.checked = checked
+        # products are hashed a lot in set operations, compute it only once
+        self._key = (md5, size)
+        self._hash = hash(self._key)
+
+    @property
+    def slug_name(self) -> str:
+        return cached_slugify(self.name)
+
+    @property
+    def bundle_folder(self) -> str:
+        return bundle_folder(self.date, self.bundle_name)
+
+    @property
+    def filename(self) -> str:
+        return extract_filename(self)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Product):
             return NotImplemented
-        return self.md5 == other.md5 and self.size == other.size
+        return self._key == other._key
 
     def __hash__(self) -> int:
-        return hash(f'{self.md5}{self.size}')
+        return self._hash
 
 
 if __name__ == '__main__':